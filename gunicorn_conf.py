@@ -0,0 +1,32 @@
+# gunicorn_conf.py  (gunicorn -c gunicorn_conf.py main:app)
+import math
+import os
+from pathlib import Path
+
+DEFAULT_WORKERS = 2  # no CPU quota found: stay small, SQLite has a single writer
+
+
+def _container_cpus() -> int | None:
+    """CPU limit from the cgroup quota (cpu_count() reports the host's cores)."""
+    try:  # cgroup v2: "max 100000" or "<quota> <period>"
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+_cpus = _container_cpus()
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", _cpus * 2 + 1 if _cpus else DEFAULT_WORKERS))
+worker_class = "uvicorn_worker.UvicornWorker"
+keepalive = 30
@@ -1,13 +1,14 @@
 # main.py
-from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Union
 import pandas as pd
 from io import BytesIO, StringIO
-import requests, time, os, sqlite3
+import httpx, asyncio, random, time, os, sqlite3, threading, queue, atexit
 from hashlib import sha256
+import xxhash
 from pathlib import Path
 
 # ────────────────────────────────────────────────────────────────────────────────
@@ -25,7 +26,7 @@ HUBSPOT_API_BASE = "https://api.hubapi.com"
 # ────────────────────────────────────────────────────────────────────────────────
 # App / CORS
 # ────────────────────────────────────────────────────────────────────────────────
-app = FastAPI(title="SheetSync AI API")
+app = FastAPI(title="SheetSync AI API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,9 +40,18 @@ app.add_middleware(
 # SQLite (idempotency + logs)
 # ────────────────────────────────────────────────────────────────────────────────
 DB_PATH = BASE_DIR / "sheetsync.db"
-
-def ensure_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+DB_OPTIMIZE_SECS = 15 * 60  # periodic PRAGMA optimize
+
+def ensure_db(path=DB_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=512)
+    # WAL: writers don't block readers, commits need far fewer fsyncs
+    if str(path) != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA busy_timeout=5000")
     conn.execute("""
       CREATE TABLE IF NOT EXISTS events (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,31 +65,183 @@ def ensure_db():
         ts DATETIME DEFAULT CURRENT_TIMESTAMP
       )
     """)
+    # already_processed() probe (/logs/recent walks the rowid B-tree of `id`);
+    # ANALYZE only when the index is new, later stats refreshes are left to the
+    # PRAGMA optimize timer
+    new_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_events_dedup'"
+    ).fetchone() is None
+    conn.execute("""
+      CREATE INDEX IF NOT EXISTS idx_events_dedup
+      ON events(spreadsheet_id, sheet_name, row_index, row_hash)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_events_id_desc")  # duplicated the rowid
+    if new_index:
+        conn.execute("ANALYZE")
+    conn.commit()
     return conn
 
-DB = ensure_db()
+# Opened per process in _open_db() (startup): SQLite handles aren't fork-safe,
+# so each gunicorn worker needs its own connection, writer thread and timer.
+DB: Optional[sqlite3.Connection] = None
+
+def _schedule_db_optimize():
+    t = threading.Timer(DB_OPTIMIZE_SECS, _optimize_db)
+    t.daemon = True
+    t.start()
+
+def _optimize_db():
+    try:
+        DB.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print("PRAGMA optimize failed:", repr(e))
+    _schedule_db_optimize()
+
+# Rows logged before the switch to xxh3 carry sha256 hashes; also match those
+# until ROW_HASH_LEGACY=0 (once old rows no longer need dedupe protection).
+ROW_HASH_LEGACY = os.getenv("ROW_HASH_LEGACY", "1") == "1"
 
 def row_hash(headers: List[str], values: List[Any]) -> str:
+    data = "|".join(map(str, headers)) + "\n" + "|".join(map(str, values))
+    return xxhash.xxh3_128_hexdigest(data.encode("utf-8"))
+
+def legacy_row_hash(headers: List[str], values: List[Any]) -> str:
     h = sha256()
     h.update(("|".join([str(x) for x in headers])).encode("utf-8"))
     h.update(("|".join([str(x) for x in values])).encode("utf-8"))
     return h.hexdigest()
 
+# Hot statements as constants so the connection's statement cache always hits.
+SQL_ALREADY_PROCESSED = (
+    "SELECT 1 FROM events WHERE spreadsheet_id=? AND sheet_name=? AND row_index=? AND row_hash=? LIMIT 1"
+)
+SQL_INSERT_EVENT = (
+    "INSERT INTO events (spreadsheet_id, sheet_name, row_index, row_hash, hubspot_id, action, detail) "
+    "VALUES (?,?,?,?,?,?,?)"
+)
+
+# log_event() only enqueues; a writer thread flushes in batched transactions.
+LOG_BATCH_MAX = 500
+LOG_FLUSH_SECS = 0.2
+LOG_WRITE_BACKOFF_MAX = 5.0
+
+_LOG_QUEUE: "queue.Queue[Optional[tuple]]" = queue.Queue()
+_PENDING_KEYS: Dict[tuple, int] = {}  # dedupe keys queued but not yet committed
+_PENDING_LOCK = threading.Lock()
+
 def already_processed(spreadsheet_id: str, sheet_name: str, row_index: int, r_hash: str) -> bool:
-    cur = DB.execute(
-        "SELECT 1 FROM events WHERE spreadsheet_id=? AND sheet_name=? AND row_index=? AND row_hash=? LIMIT 1",
-        (spreadsheet_id, sheet_name, row_index, r_hash)
-    )
+    with _PENDING_LOCK:
+        if (spreadsheet_id, sheet_name, row_index, r_hash) in _PENDING_KEYS:
+            return True
+    cur = DB.execute(SQL_ALREADY_PROCESSED, (spreadsheet_id, sheet_name, row_index, r_hash))
     return cur.fetchone() is not None
 
+DEDUPE_CHUNK = 200  # 4 params per key; stays under SQLite's variable limit
+
+def processed_keys(keys: List[tuple]) -> Set[tuple]:
+    """Subset of (spreadsheet_id, sheet_name, row_index, row_hash) keys already logged.
+
+    Failed rows ('error' events) don't count, so a re-sent sheet retries them.
+    """
+    with _PENDING_LOCK:
+        found = {k for k in keys if k in _PENDING_KEYS}
+    todo = [k for k in dict.fromkeys(keys) if k not in found]
+    for i in range(0, len(todo), DEDUPE_CHUNK):
+        chunk = todo[i:i + DEDUPE_CHUNK]
+        cur = DB.execute(
+            "WITH k(spreadsheet_id, sheet_name, row_index, row_hash) AS (VALUES "
+            + ",".join(["(?,?,?,?)"] * len(chunk)) + ") "
+            "SELECT DISTINCT e.spreadsheet_id, e.sheet_name, e.row_index, e.row_hash "
+            "FROM k JOIN events e USING (spreadsheet_id, sheet_name, row_index, row_hash) "
+            "WHERE e.action != 'error'",
+            [p for key in chunk for p in key]
+        )
+        found.update(tuple(r) for r in cur.fetchall())
+    return found
+
 def log_event(spreadsheet_id: str, sheet_name: str, row_index: int, r_hash: str,
               action: str, hubspot_id: Optional[str] = "", detail: str = ""):
-    DB.execute(
-        "INSERT INTO events (spreadsheet_id, sheet_name, row_index, row_hash, hubspot_id, action, detail) "
-        "VALUES (?,?,?,?,?,?,?)",
-        (spreadsheet_id, sheet_name, row_index, r_hash, hubspot_id or "", action, detail[:2000])
-    )
-    DB.commit()
+    log_events([(spreadsheet_id, sheet_name, row_index, r_hash, hubspot_id or "", action, detail)])
+
+def log_events(events: List[tuple]) -> None:
+    """Enqueue (spreadsheet_id, sheet_name, row_index, row_hash, hubspot_id, action, detail) rows."""
+    with _PENDING_LOCK:
+        for ev in events:
+            if ev[5] != "error":
+                key = ev[:4]
+                _PENDING_KEYS[key] = _PENDING_KEYS.get(key, 0) + 1
+    for ev in events:
+        _LOG_QUEUE.put(ev[:6] + (ev[6][:2000],))
+
+def _write_events(conn: sqlite3.Connection, cur: sqlite3.Cursor, batch: List[tuple]) -> None:
+    # SQLITE_BUSY/locked (other workers' writers) is transient: keep retrying the
+    # same batch with backoff so dedupe records are never silently dropped
+    delay = 0.1
+    while True:
+        try:
+            with conn:  # one transaction (one fsync) per batch
+                cur.executemany(SQL_INSERT_EVENT, batch)
+            break
+        except sqlite3.OperationalError as e:
+            print(f"event batch write failed, retrying in {delay:.1f}s:", repr(e))
+            time.sleep(delay)
+            delay = min(delay * 2, LOG_WRITE_BACKOFF_MAX)
+        except sqlite3.Error as e:
+            print("event batch write failed:", repr(e))
+            break
+    with _PENDING_LOCK:
+        for ev in batch:
+            if ev[5] == "error":
+                continue
+            key = ev[:4]
+            n = _PENDING_KEYS.get(key, 0) - 1
+            if n > 0:
+                _PENDING_KEYS[key] = n
+            else:
+                _PENDING_KEYS.pop(key, None)
+
+def _event_writer():
+    conn = ensure_db()  # own connection; WAL lets it write while DB serves reads
+    cur = conn.cursor()  # reused across flushes
+    stop = False
+    while not stop:
+        first = _LOG_QUEUE.get()
+        if first is None:
+            break
+        batch = [first]
+        deadline = time.monotonic() + LOG_FLUSH_SECS
+        while len(batch) < LOG_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ev = _LOG_QUEUE.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if ev is None:
+                stop = True
+                break
+            batch.append(ev)
+        _write_events(conn, cur, batch)
+    conn.close()
+
+_EVENT_WRITER: Optional[threading.Thread] = None
+
+@app.on_event("startup")
+def _open_db():
+    global DB, _EVENT_WRITER
+    DB = ensure_db()
+    _EVENT_WRITER = threading.Thread(target=_event_writer, name="event-writer", daemon=True)
+    _EVENT_WRITER.start()
+    _schedule_db_optimize()
+
+@app.on_event("shutdown")
+@atexit.register
+def _flush_events_on_exit():
+    if _EVENT_WRITER is None or not _EVENT_WRITER.is_alive():
+        return
+    _LOG_QUEUE.put(None)
+    _EVENT_WRITER.join(timeout=10)
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Health / env / logs
@@ -100,15 +262,26 @@ def env_check():
     }
 
 @app.get("/logs/recent")
-def logs_recent(limit: int = 30):
-    cur = DB.execute(
-        "SELECT spreadsheet_id, sheet_name, row_index, hubspot_id, action, detail, ts "
-        "FROM events ORDER BY id DESC LIMIT ?",
-        (limit,)
-    )
-    cols = [c[0] for c in cur.description]
-    rows = [dict(zip(cols, r)) for r in cur.fetchall()]
-    return {"ok": True, "events": rows}
+def logs_recent(limit: int = Query(30, ge=1, le=1000), before_id: Optional[int] = None):
+    # keyset pagination: pass next_before_id back as before_id for the next page
+    cur = DB.cursor()
+    cur.row_factory = sqlite3.Row
+    if before_id is None:
+        cur.execute(
+            "SELECT id, spreadsheet_id, sheet_name, row_index, hubspot_id, action, detail, ts "
+            "FROM events ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+    else:
+        cur.execute(
+            "SELECT id, spreadsheet_id, sheet_name, row_index, hubspot_id, action, detail, ts "
+            "FROM events WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit)
+        )
+    rows = [dict(r) for r in cur]
+    next_before_id = rows[-1]["id"] if rows and len(rows) == limit else None
+    # already plain JSON types; skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse({"ok": True, "events": rows, "next_before_id": next_before_id})
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Helpers: cleaning + header mapping
@@ -121,8 +294,19 @@ HEADER_ALIASES = {
     "company": {"company", "account", "organisation", "organization"},
 }
 
+# deletion table for every non-alphanumeric Latin-1 char (headers are ASCII in practice)
+_NON_ALNUM = str.maketrans("", "", "".join(chr(c) for c in range(256) if not chr(c).isalnum()))
+
 def _norm(s: str) -> str:
-    return "".join(ch for ch in str(s).strip().lower() if ch.isalnum())
+    s = str(s).strip().lower()
+    if s.isascii():
+        return s.translate(_NON_ALNUM)
+    return "".join(ch for ch in s if ch.isalnum())
+
+# normalized alias -> canonical property, built once
+ALIAS_LOOKUP: Dict[str, str] = {
+    _norm(a): prop for prop, aliases in HEADER_ALIASES.items() for a in aliases
+} | {prop: prop for prop in HEADER_ALIASES}
 
 def map_row_to_contact(headers: List[str],
                        values: List[Optional[str]],
@@ -139,12 +323,10 @@ def map_row_to_contact(headers: List[str],
                 if idx < len(vals): contact[prop] = vals[idx]
     else:
         # heuristic aliases
-        hnorm = [_norm(h) for h in headers]
-        for prop, aliases in HEADER_ALIASES.items():
-            for i, h in enumerate(hnorm):
-                if h in {_norm(a) for a in aliases}:
-                    if i < len(vals): contact[prop] = vals[i]
-                    break
+        for i, h in enumerate(headers):
+            prop = ALIAS_LOOKUP.get(_norm(h))
+            if prop and i < len(vals) and not contact[prop]:
+                contact[prop] = vals[i]
 
     contact["email"] = contact["email"].strip().lower()
     # drop empties so we don't blank HubSpot fields
@@ -153,55 +335,75 @@ def map_row_to_contact(headers: List[str],
 # ────────────────────────────────────────────────────────────────────────────────
 # HubSpot client with retries
 # ────────────────────────────────────────────────────────────────────────────────
-def _hs_headers() -> Dict[str, str]:
+# built once; the token is read from .env at import and never changes
+_HS_HEADERS = {"Authorization": f"Bearer {HUBSPOT_ACCESS_TOKEN}", "Content-Type": "application/json"}
+
+# one pooled keep-alive HTTP/2 client shared by every request on the event loop
+HS_ASYNC = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    headers=_HS_HEADERS,
+)
+
+@app.on_event("shutdown")
+async def _close_hs_client():
+    await HS_ASYNC.aclose()
+
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_AFTER_MAX = 10  # seconds; don't park a request on a huge Retry-After
+
+async def _request_retry(method: str, url: str, **kw) -> httpx.Response:
     if not HUBSPOT_ACCESS_TOKEN:
         raise HTTPException(status_code=400, detail="HUBSPOT_ACCESS_TOKEN missing")
-    return {"Authorization": f"Bearer {HUBSPOT_ACCESS_TOKEN}", "Content-Type": "application/json"}
-
-def _request_retry(method: str, url: str, **kw) -> requests.Response:
-    # backoff: 0.5, 1, 2, 4 (seconds)
+    # only rate limits / gateway hiccups are worth retrying; other 5xx fail fast
+    # backoff: Retry-After if sent, else 0.5, 1, 2, 4 (seconds), plus jitter
     for attempt in range(5):
-        r = requests.request(method, url, timeout=30, **kw)
-        if r.status_code < 500 and r.status_code != 429:
+        r = await HS_ASYNC.request(method, url, **kw)
+        if r.status_code not in RETRY_STATUSES or attempt == 4:
             return r
-        time.sleep(min(0.5 * (2 ** attempt), 6))
-    return r
-
-def hubspot_find_contact_by_email(email: str) -> Optional[str]:
-    url = f"{HUBSPOT_API_BASE}/crm/v3/objects/contacts/search"
-    payload = {"filterGroups":[{"filters":[{"propertyName":"email","operator":"EQ","value":email}]}],
-               "properties":["email"]}
-    r = _request_retry("POST", url, headers=_hs_headers(), json=payload)
+        try:
+            delay = max(0.0, min(float(r.headers.get("Retry-After", 0)), RETRY_AFTER_MAX))
+        except ValueError:  # HTTP-date form
+            delay = 0
+        delay = delay or min(0.5 * (2 ** attempt), 6)
+        await asyncio.sleep(delay + random.uniform(0, 0.25))
+
+HUBSPOT_BATCH_MAX = 100  # batch/upsert input limit
+
+class HubSpotError(HTTPException):
+    """HubSpot rejected a call; surfaces as 502 but keeps HubSpot's own status."""
+    def __init__(self, hs_status: int, detail: str):
+        super().__init__(status_code=502, detail=detail)
+        self.hs_status = hs_status
+
+async def hubspot_upsert_contacts(contacts: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Find-or-create up to HUBSPOT_BATCH_MAX contacts keyed on email in one round-trip."""
+    url = f"{HUBSPOT_API_BASE}/crm/v3/objects/contacts/batch/upsert"
+    emails = list(contacts)
+    payload = {"inputs": [{"idProperty": "email", "id": e, "properties": contacts[e]} for e in emails]}
+    r = await _request_retry("POST", url, json=payload)
     if r.status_code >= 400:
-        raise HTTPException(status_code=502, detail=f"HubSpot search error: {r.text}")
+        raise HubSpotError(r.status_code, f"HubSpot upsert error: {r.text}")
     results = r.json().get("results", [])
-    return results[0].get("id") if results else None
-
-def hubspot_create_contact(props: Dict[str, Any]) -> str:
-    url = f"{HUBSPOT_API_BASE}/crm/v3/objects/contacts"
-    r = _request_retry("POST", url, headers=_hs_headers(), json={"properties": props})
-    if r.status_code >= 400:
-        raise HTTPException(status_code=502, detail=f"HubSpot create error: {r.text}")
-    return r.json().get("id", "")
-
-def hubspot_update_contact(contact_id: str, props: Dict[str, Any]) -> None:
-    url = f"{HUBSPOT_API_BASE}/crm/v3/objects/contacts/{contact_id}"
-    r = _request_retry("PATCH", url, headers=_hs_headers(), json={"properties": props})
-    if r.status_code >= 400:
-        raise HTTPException(status_code=502, detail=f"HubSpot update error: {r.text}")
-
-def upsert_contact_to_hubspot(contact: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for res in results:
+        email = ((res.get("properties") or {}).get("email") or "").strip().lower()
+        if email:
+            out[email] = res
+    return out
+
+async def upsert_contact_to_hubspot(contact: Dict[str, Any]) -> Dict[str, Any]:
     email = (contact.get("email") or "").strip().lower()
     if not email:
         return {"skipped": True, "reason": "missing email"}
     props = {k: v for k, v in contact.items() if v not in (None, "")}
-    cid = hubspot_find_contact_by_email(email)
-    if cid:
-        hubspot_update_contact(cid, props)
-        return {"updated": True, "id": cid}
-    else:
-        new_id = hubspot_create_contact(props)
-        return {"created": True, "id": new_id}
+    res = (await hubspot_upsert_contacts({email: props})).get(email)
+    if res is None:
+        raise HTTPException(status_code=502, detail="HubSpot upsert error: no result")
+    if res.get("new"):
+        return {"created": True, "id": res.get("id", "")}
+    return {"updated": True, "id": res.get("id", "")}
 
 # ────────────────────────────────────────────────────────────────────────────────
 # File preview endpoints (unchanged, handy for manual tests)
@@ -228,7 +430,7 @@ async def upload_file(file: UploadFile = File(...), mapping: str = Form(...)):
 # ────────────────────────────────────────────────────────────────────────────────
 # Google Sheets row ingest
 # ────────────────────────────────────────────────────────────────────────────────
-# ---- model for single-row ingest ----
+# ---- models for single-row / batch ingest ----
 class IngestRowPayload(BaseModel):
     spreadsheetId: str
     sheetName: str
@@ -236,18 +438,31 @@ class IngestRowPayload(BaseModel):
     headers: Optional[List[str]] = None
     values: List[Optional[str]]
     mapping: Optional[Dict[str, str]] = None
+    rowHash: Optional[str] = None  # precomputed by bulk senders (watch_excel)
+
+class IngestRowsBatchPayload(BaseModel):
+    rows: List[IngestRowPayload]
 
-# ---- single-row ingest endpoint ----
+# ---- row ingest endpoint (one row, or {"rows": [...]}) ----
 @app.post("/ingest/rows")
-def ingest_rows(payload: IngestRowPayload, x_bridge_secret: str = Header(None)):
+async def ingest_rows(payload: Union[IngestRowsBatchPayload, IngestRowPayload],
+                      x_bridge_secret: str = Header(None)):
     if x_bridge_secret != BRIDGE_SECRET:
         raise HTTPException(status_code=401, detail="Invalid secret")
+    if isinstance(payload, IngestRowsBatchPayload):
+        return await ingest_rows_batch(payload.rows)
 
     headers = payload.headers or []
     values  = payload.values or []
 
-    r_hash = row_hash(headers, values)
-    if already_processed(payload.spreadsheetId, payload.sheetName, payload.rowIndex, r_hash):
+    r_hash = payload.rowHash or row_hash(headers, values)
+    seen = await asyncio.to_thread(already_processed, payload.spreadsheetId, payload.sheetName,
+                                   payload.rowIndex, r_hash)
+    if not seen and ROW_HASH_LEGACY and not payload.rowHash:
+        # sha256 only on a miss, like ingest_rows_batch
+        seen = await asyncio.to_thread(already_processed, payload.spreadsheetId, payload.sheetName,
+                                       payload.rowIndex, legacy_row_hash(headers, values))
+    if seen:
         log_event(payload.spreadsheetId, payload.sheetName, payload.rowIndex, r_hash, "duplicate")
         return {"ok": True, "duplicate": True}
 
@@ -258,7 +473,7 @@ def ingest_rows(payload: IngestRowPayload, x_bridge_secret: str = Header(None)):
                       "skipped", "", "missing email")
             return {"ok": True, "skipped": True, "reason": "missing email"}
 
-        res = upsert_contact_to_hubspot(contact)
+        res = await upsert_contact_to_hubspot(contact)
         action = "updated" if res.get("updated") else "created" if res.get("created") else "unknown"
         log_event(payload.spreadsheetId, payload.sheetName, payload.rowIndex, r_hash,
                   action, res.get("id", ""), str(contact))
@@ -267,3 +482,72 @@ def ingest_rows(payload: IngestRowPayload, x_bridge_secret: str = Header(None)):
     except Exception as e:
         log_event(payload.spreadsheetId, payload.sheetName, payload.rowIndex, r_hash, "error", "", repr(e))
         raise
+
+async def _upsert_chunk(contacts: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Upsert a chunk; on a HubSpot 4xx (one bad input fails the whole call) split
+    and retry so only the offending contacts end up as errors."""
+    try:
+        return await hubspot_upsert_contacts(contacts)
+    except HubSpotError as e:
+        if len(contacts) == 1 or not 400 <= e.hs_status < 500 or e.hs_status == 429:
+            return {em: e for em in contacts}
+        items = list(contacts.items())
+        half = len(items) // 2
+        out = await _upsert_chunk(dict(items[:half]))
+        out.update(await _upsert_chunk(dict(items[half:])))
+        return out
+    except Exception as e:
+        return {em: e for em in contacts}
+
+async def ingest_rows_batch(rows: List[IngestRowPayload]) -> Dict[str, Any]:
+    keys = [(p.spreadsheetId, p.sheetName, p.rowIndex,
+             p.rowHash or row_hash(p.headers or [], p.values or []))
+            for p in rows]
+    seen = await asyncio.to_thread(processed_keys, keys)
+    if ROW_HASH_LEGACY:
+        legacy = {(p.spreadsheetId, p.sheetName, p.rowIndex,
+                   legacy_row_hash(p.headers or [], p.values or [])): key
+                  for p, key in zip(rows, keys) if not p.rowHash and key not in seen}
+        if legacy:
+            found = await asyncio.to_thread(processed_keys, list(legacy))
+            seen.update(legacy[k] for k in found)
+
+    results: List[Dict[str, Any]] = [{} for _ in rows]
+    events: List[tuple] = []
+    contacts: Dict[int, Dict[str, Any]] = {}
+    by_email: Dict[str, Dict[str, Any]] = {}  # merged props, later rows win
+    duplicates = 0
+    for i, (p, key) in enumerate(zip(rows, keys)):
+        if key in seen:
+            # counted, not logged: the watcher re-sends the whole sheet on every save
+            duplicates += 1
+            results[i] = {"duplicate": True}
+            continue
+        seen.add(key)
+        contact = map_row_to_contact(p.headers or [], p.values or [], p.mapping)
+        if not contact.get("email"):
+            events.append(key + ("", "skipped", "missing email"))
+            results[i] = {"skipped": True, "reason": "missing email"}
+            continue
+        contacts[i] = contact
+        by_email.setdefault(contact["email"], {}).update(contact)
+
+    emails = list(by_email)
+    upserted: Dict[str, Any] = {}
+    for j in range(0, len(emails), HUBSPOT_BATCH_MAX):
+        chunk = emails[j:j + HUBSPOT_BATCH_MAX]
+        upserted.update(await _upsert_chunk({e: by_email[e] for e in chunk}))
+
+    for i, contact in contacts.items():
+        res = upserted.get(contact["email"])
+        if isinstance(res, dict):
+            action = "created" if res.get("new") else "updated"
+            events.append(keys[i] + (res.get("id", ""), action, str(contact)))
+            results[i] = {action: True, "id": res.get("id", "")}
+        else:
+            err = repr(res) if res is not None else "no result from HubSpot"
+            events.append(keys[i] + ("", "error", err))
+            results[i] = {"error": err}
+
+    log_events(events)
+    return {"ok": True, "duplicates": duplicates, "results": results}
@@ -1,3 +1,4 @@
+# start.py  -- local dev only (single process); deploys use gunicorn_conf.py
 import os, uvicorn
 port = int(os.getenv("PORT", "8000"))
 uvicorn.run("main:app", host="0.0.0.0", port=port)
@@ -1,17 +1,30 @@
 # watch_excel.py
 import os
+import sys
 import time
-import json
+import orjson
 import shutil
 import requests
+import openpyxl
 import pandas as pd
+from datetime import date, timedelta
+from itertools import islice
 from pathlib import Path
-from watchdog.observers import Observer
+from typing import BinaryIO, Iterator
+if sys.platform.startswith("linux"):
+    # inotify backend delivers IN_CLOSE_WRITE as on_closed: the save is complete
+    from watchdog.observers.inotify import InotifyObserver as Observer
+else:
+    from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from dotenv import load_dotenv
+if os.name == "nt":
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
 
 print("SCRIPT:", __file__)
-print("VERSION: tempcopy-before-suffix-v2")
+print("VERSION: shared-open-v3")
 
 # ── Load env (backend/.env if you run from backend) ────────────────────────────
 load_dotenv()
@@ -23,45 +36,106 @@ SECRET  = os.getenv("BRIDGE_SECRET", "change-me")
 WATCH_FILE = Path(r"C:\Users\toufi\Downloads\sample_contacts.csv").resolve()
 
 # Tuning
-READ_RETRIES     = 40    # total attempts while file is locked
-RETRY_DELAY_SECS = 0.75  # wait between attempts
+READ_RETRIES     = 20    # total attempts while file is locked
+RETRY_DELAY_SECS = 0.25  # wait between attempts
 DEBOUNCE_SECS    = 1.0   # ignore duplicate bursts
+BATCH_ROWS       = 500   # rows per POST to /ingest/rows
+SHARING_VIOLATION_TRIES = 2  # then assume Excel just has the workbook open
+STABLE_CHECK_SECS = 0.2
+CSV_STREAM_BYTES  = 16 * 1024 * 1024  # above this, stream CSVs in chunks
+XLSX_STREAM_BYTES = 4 * 1024 * 1024   # xlsx is zipped, so the row count is ~4x higher per byte
+CHUNK_ROWS        = 50_000
 
 WATCH_DIR   = WATCH_FILE.parent
 TARGET_NAME = WATCH_FILE.name
 _last_event = 0.0
+CLOSE_EVENTS = sys.platform.startswith("linux")
 
+# reuse one keep-alive connection to the API across change events
+SESSION = requests.Session()
+SESSION.headers.update({"X-Bridge-Secret": SECRET, "Content-Type": "application/json"})
 
-def wait_until_stable(path: Path, checks: int = 3, interval: float = 0.3) -> bool:
-    """Wait until file size stays the same for `checks` intervals (file finished saving)."""
+
+GENERIC_READ  = 0x80000000
+GENERIC_WRITE = 0x40000000
+ERROR_SHARING_VIOLATION = 32
+_KERNEL32 = None
+
+
+def _kernel32():
+    global _KERNEL32
+    if _KERNEL32 is None:
+        _KERNEL32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        _KERNEL32.CreateFileW.restype = wintypes.HANDLE
+        _KERNEL32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                          wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+    return _KERNEL32
+
+
+def _create_file(path: Path, access: int, share: int) -> tuple:
+    """CreateFileW(OPEN_EXISTING) -> (handle, 0) or (None, GetLastError())."""
+    handle = _kernel32().CreateFileW(
+        str(path),
+        access,
+        share,
+        None,
+        3,     # OPEN_EXISTING
+        0x80,  # FILE_ATTRIBUTE_NORMAL
+        None,
+    )
+    if handle is None or handle == wintypes.HANDLE(-1).value:
+        return None, ctypes.get_last_error()
+    return handle, 0
+
+
+def _wait_size_stable(path: Path) -> bool:
+    """Wait until two size reads STABLE_CHECK_SECS apart agree (file finished saving)."""
     last_size = -1
-    stable = 0
     for _ in range(READ_RETRIES):
         try:
             size = path.stat().st_size
-        except FileNotFoundError:
-            time.sleep(interval)
-            continue
+        except OSError:
+            size = -1
         if size == last_size and size > 0:
-            stable += 1
-            if stable >= checks:
-                return True
-        else:
-            stable = 0
-            last_size = size
-        time.sleep(interval)
+            return True
+        last_size = size
+        time.sleep(STABLE_CHECK_SECS)
+    return False
+
+
+def wait_until_released(path: Path) -> bool:
+    """Wait until the writer has let go of the file.
+
+    On Windows an open with share mode 0 fails (sharing violation) while any
+    writer still has the file open, whatever share mode it used. Excel
+    also keeps an *open* workbook locked, so after a couple of violations we
+    settle for a short size-stability check instead. On Linux the handler only
+    acts on IN_CLOSE_WRITE or a rename into place, so the file just has to exist.
+    """
+    if os.name != "nt":
+        return path.exists()
+    violations = 0
+    for _ in range(READ_RETRIES):
+        # share mode 0: fails against *any* open handle, sharing or not
+        handle, err = _create_file(path, GENERIC_READ | GENERIC_WRITE, 0)
+        if handle is not None:
+            _kernel32().CloseHandle(handle)
+            return True
+        if err == ERROR_SHARING_VIOLATION:
+            violations += 1
+            if violations >= SHARING_VIOLATION_TRIES:
+                return _wait_size_stable(path)
+        time.sleep(RETRY_DELAY_SECS)
     return False
 
 
 def copy_to_temp(path: Path) -> Path | None:
     """
-    Copy to a temp path next to the source (to bypass file locks).
+    Copy to a temp path next to the source (fallback when open_shared() is refused).
     IMPORTANT: keep the original suffix at the end so pandas detects the type.
       e.g.  sample_contacts.csv -> sample_contacts.tmpcopy.csv
             data.xlsx          -> data.tmpcopy.xlsx
     """
-    if not wait_until_stable(path):
-        return None
     temp_path = path.with_name(f"{path.stem}.tmpcopy{path.suffix}")
     for _ in range(READ_RETRIES):
         try:
@@ -72,67 +146,186 @@ def copy_to_temp(path: Path) -> Path | None:
     return None
 
 
-def read_table_any(path: Path) -> pd.DataFrame | None:
-    """Read CSV or XLSX from a temp copy to avoid lock/partial writes."""
-    tmp = copy_to_temp(path)
-    if tmp is None:
+def open_shared(path: Path) -> BinaryIO | None:
+    """
+    Open for reading while allowing the writer to keep writing/renaming/deleting,
+    so we can parse in place instead of copying. None if the open fails.
+    """
+    if os.name != "nt":
+        try:
+            return open(path, "rb")
+        except OSError:
+            return None
+    # FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE
+    handle, _ = _create_file(path, GENERIC_READ, 7)
+    if handle is None:
         return None
     try:
-        suf = tmp.suffix.lower()
-        if suf in (".xlsx", ".xls"):
-            df = pd.read_excel(tmp, engine="openpyxl")
-        elif suf == ".csv":
-            # tolerate odd encodings; fallback to python engine if needed
-            try:
-                df = pd.read_csv(tmp, encoding="utf-8", errors="ignore")
-            except Exception:
-                df = pd.read_csv(tmp, engine="python")
-        else:
-            print(f"⚠️ Unsupported file type: {suf}")
-            return None
-        return df
+        fd = msvcrt.open_osfhandle(handle, os.O_RDONLY | os.O_BINARY)
+    except OSError:
+        _kernel32().CloseHandle(handle)
+        return None
+    return os.fdopen(fd, "rb")
+
+
+def _read_excel(f: BinaryIO) -> pd.DataFrame:
+    # dtype=str: no float upcasting of int columns with blanks ("5" not "5.0")
+    try:
+        return pd.read_excel(f, engine="calamine", dtype=str)  # Rust reader, much faster than openpyxl
+    except (ImportError, ValueError):
+        f.seek(0)
+        return pd.read_excel(f, engine="openpyxl", dtype=str)
+
+
+def _cell_str(v) -> str:
+    """Stringify a raw cell exactly like pd.read_excel(dtype=str) + fillna("")."""
+    if v is None or v == "":
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if isinstance(v, date):  # datetime too
+        return str(pd.Timestamp(v))
+    if isinstance(v, timedelta):
+        return str(pd.Timedelta(v))
+    return str(v)
+
+
+def _excel_headers(raw: tuple) -> list:
+    """Header row with pandas' naming: blanks -> "Unnamed: i", repeats -> "name.1"."""
+    headers, counts = [], {}
+    for i, h in enumerate(raw):
+        col = _cell_str(h) or f"Unnamed: {i}"
+        cur = counts.get(col, 0)
+        while cur > 0:  # same walk as pandas' dedup_names
+            counts[col] = cur + 1
+            col = f"{col}.{cur}"
+            cur = counts.get(col, 0)
+        counts[col] = cur + 1
+        headers.append(col)
+    return headers
+
+
+def _xlsx_rows(f: BinaryIO) -> Iterator[tuple]:
+    """Raw rows of the first sheet, streamed: calamine if available, else openpyxl read-only."""
+    try:
+        from python_calamine import CalamineWorkbook
+        rows = CalamineWorkbook.from_filelike(f).get_sheet_by_index(0).iter_rows()
+    except (ImportError, AttributeError):
+        rows = None
+    if rows is not None:
+        for r in rows:
+            yield tuple(r)
+        return
+    f.seek(0)
+    wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
     finally:
-        try:
-            tmp.unlink(missing_ok=True)
-        except Exception:
-            pass
+        wb.close()
+
+
+def _iter_xlsx(f: BinaryIO) -> Iterator[pd.DataFrame]:
+    """Stream the first sheet in CHUNK_ROWS frames, with the same strings as _read_excel."""
+    rows = _xlsx_rows(f)
+    headers = _excel_headers(next(rows, ()))
+    width = len(headers)
+    rows = (tuple(_cell_str(v) for v in (r + (None,) * width)[:width])
+            for r in rows if any(v not in (None, "") for v in r))
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        yield pd.DataFrame(chunk, columns=headers)
+
+
+# Every cell is sent as a string anyway: read as str with no NA/type inference so
+# all engines (and every chunk) give identical strings, hence identical row hashes.
+CSV_STR_OPTS = {"dtype": str, "keep_default_na": False}
+
+
+def _read_csv(f: BinaryIO) -> pd.DataFrame:
+    try:
+        return pd.read_csv(f, engine="pyarrow", **CSV_STR_OPTS)  # multithreaded
+    except (ImportError, ValueError):
+        f.seek(0)
+    # tolerate odd encodings; fallback to python engine if needed
+    try:
+        return pd.read_csv(f, engine="c", encoding="utf-8", encoding_errors="ignore",
+                           low_memory=False, **CSV_STR_OPTS)
+    except Exception:
+        f.seek(0)
+        return pd.read_csv(f, engine="python", **CSV_STR_OPTS)
+
+
+def read_table_any(f: BinaryIO, suffix: str) -> Iterator[pd.DataFrame]:
+    """Yield CSV or XLSX contents; big files stream in CHUNK_ROWS-row chunks."""
+    suf = suffix.lower()
+    size = os.fstat(f.fileno()).st_size
+    if suf == ".xlsx" and size > XLSX_STREAM_BYTES:
+        yield from _iter_xlsx(f)
+    elif suf in (".xlsx", ".xls"):
+        yield _read_excel(f)
+    elif suf == ".csv":
+        if size > CSV_STREAM_BYTES:
+            yield from pd.read_csv(f, engine="c", encoding="utf-8", encoding_errors="ignore",
+                                   chunksize=CHUNK_ROWS, **CSV_STR_OPTS)
+        else:
+            yield _read_csv(f)
+    else:
+        print(f"⚠️ Unsupported file type: {suf}")
 
 
-def send_first_row(df: pd.DataFrame):
-    """Send header + first data row to the API (/ingest/rows)."""
+def send_rows(df: pd.DataFrame, offset: int = 0):
+    """Send header + every data row to the API (/ingest/rows) in batches.
+
+    `offset` is the index of df's first row within the file (for chunked reads).
+    """
     if df.empty:
         print("⚠️ No rows to send.")
         return
 
     df2 = df.fillna("").astype(str)
     headers = list(map(str, df2.columns.tolist()))
-    row     = df2.iloc[0].tolist()
+    rows    = df2.values.tolist()
+    # one vectorised pass instead of a per-row sha256 on the server; mix in the
+    # header row so renaming a column re-sends rows instead of deduping them
+    header_hash = pd.util.hash_pandas_object(pd.Series(["|".join(headers)]), index=False).iloc[0]
+    row_hashes  = pd.util.hash_pandas_object(df2, index=False) ^ header_hash
+    hashes  = [f"{h:016x}" for h in row_hashes.tolist()]
 
-    payload = {
-        "spreadsheetId": "excel-desktop",
-        "sheetName": "Sheet1",
-        "rowIndex": 0,
-        "headers": headers,   # include headers for backend auto-mapping
-        "values": row
-    }
+    for start in range(0, len(rows), BATCH_ROWS):
+        payload = {
+            "rows": [
+                {
+                    "spreadsheetId": "excel-desktop",
+                    "sheetName": "Sheet1",
+                    "rowIndex": offset + start + i,
+                    "headers": headers,   # include headers for backend auto-mapping
+                    "values": row,
+                    "rowHash": h,
+                }
+                for i, (row, h) in enumerate(zip(rows[start:start + BATCH_ROWS],
+                                                 hashes[start:start + BATCH_ROWS]))
+            ]
+        }
 
-    try:
-        r = requests.post(
-            API_URL,
-            headers={"X-Bridge-Secret": SECRET, "Content-Type": "application/json"},
-            data=json.dumps(payload),
-            timeout=30
-        )
-        print(f"📤 POST {API_URL} → {r.status_code}")
-        if r.status_code >= 400:
-            print("💥 Error body:", r.text[:500])
-        else:
-            try:
-                print("✅ Server:", r.json())
-            except Exception:
-                print("✅ Server (text):", r.text[:200])
-    except Exception as e:
-        print("💥 Request failed:", repr(e))
+        try:
+            r = SESSION.post(
+                API_URL,
+                data=orjson.dumps(payload),
+                timeout=30
+            )
+            first = offset + start
+            print(f"📤 POST {API_URL} rows {first}-{first + len(payload['rows']) - 1} → {r.status_code}")
+            if r.status_code >= 400:
+                print("💥 Error body:", r.text[:500])
+            else:
+                try:
+                    print("✅ Server:", str(r.json())[:500])
+                except Exception:
+                    print("✅ Server (text):", r.text[:200])
+        except Exception as e:
+            print("💥 Request failed:", repr(e))
 
 
 def handle_change(path: Path):
@@ -144,19 +337,48 @@ def handle_change(path: Path):
     _last_event = now
 
     print(f"🔎 Change detected: {path}")
-    df = read_table_any(path)
-    if df is None:
-        print("❌ Could not read file (locked/partial/unsupported).")
+    if not wait_until_released(path):
+        print("❌ Could not read file (locked/partial).")
         return
-    send_first_row(df)
+    # read in place; fall back to a temp copy if the shared open is refused
+    tmp = None
+    f = open_shared(path)
+    if f is None:
+        tmp = copy_to_temp(path)
+        if tmp is None:
+            print("❌ Could not read file (locked/partial).")
+            return
+        f = open(tmp, "rb")
+    try:
+        offset = 0
+        for df in read_table_any(f, path.suffix):
+            send_rows(df, offset)
+            offset += len(df)
+    except Exception as e:
+        print("❌ Could not read file:", repr(e))
+    finally:
+        f.close()
+        if tmp is not None:
+            try:
+                tmp.unlink(missing_ok=True)
+            except Exception:
+                pass
 
 
 class FileHandler(FileSystemEventHandler):
     def on_modified(self, event):
+        if CLOSE_EVENTS:
+            return  # still being written; on_closed follows
+        if not event.is_directory and Path(event.src_path).name == TARGET_NAME:
+            handle_change(WATCH_FILE)
+
+    def on_closed(self, event):
         if not event.is_directory and Path(event.src_path).name == TARGET_NAME:
             handle_change(WATCH_FILE)
 
     def on_created(self, event):
+        if CLOSE_EVENTS:
+            return  # empty or half-written; on_closed follows
         if not event.is_directory and Path(event.src_path).name == TARGET_NAME:
             handle_change(WATCH_FILE)
 